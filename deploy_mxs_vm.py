@@ -1,54 +1,146 @@
-from shutil import copytree, rmtree  
-from urllib.request import urlretrieve
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.error import ContentTooShortError
+from urllib.request import HTTPRedirectHandler, Request, build_opener, urlopen
 from urllib.parse import urlsplit
-from typing import List, Tuple, Union
+import argparse
+from typing import List, Optional, Tuple, Union
 import traceback
 import getpass
 import grp
+import hashlib
+import pwd
 import os
+import stat
 import subprocess
 import shutil
 import sys
 import logging
 import re
+import functools
+import threading
+import time
+from glob import glob
 from pathlib import Path
-from tempfile import TemporaryDirectory
+from tempfile import TemporaryDirectory, TemporaryFile
+
+_MEMAVAIL_RE = re.compile(rb'^MemAvailable:\s+(\d+)', re.MULTILINE)
+_NODE_MEMFREE_RE = re.compile(rb'^Node \d+ MemFree:\s+(\d+)', re.MULTILINE)
+_DISTRO_RE = re.compile(rb'^ID=(.*)$', re.MULTILINE)
+_MOUNTINFO_ESCAPE_RE = re.compile(r'\\([0-7]{3})')
+
+
+class _HeadRedirectHandler(HTTPRedirectHandler):
+    """Follow redirects without turning a HEAD request into a GET."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        new_req = super().redirect_request(req, fp, code, msg, headers, newurl)
+        if new_req is not None and req.get_method() == "HEAD":
+            new_req.method = "HEAD"
+        return new_req
  
 class EntireScript:
-    def log(self, level, message):
-        logging.log(level, message)
+    _logger = logging.getLogger(__name__)
+
+    def log(self, level, message, *args):
+        """Log a %-style message; formatting is skipped when the level is disabled."""
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, message, *args)
 
 class Stage1(EntireScript):
     MIN_REQUIRED_SPACE_GB = 7
     VIRTIO_ISO_URL = "https://fedorapeople.org/groups/virt/virtio-win/direct-downloads/latest-virtio/virtio-win.iso"
     LIBVIRT_CONFIG_PATH = "/etc/libvirt/libvirtd.conf"
     QEMU_CONFIG_PATH = "/etc/libvirt/qemu.conf"
+    PACKAGES_SENTINEL = Path.home() / ".cache" / "mxs_pkgs_ok"
+    PACKAGES_SENTINEL_MAX_AGE = 24 * 60 * 60
+    UEFI_PATHS = {
+        "ubuntu": "/usr/share/OVMF/OVMF_CODE_4M.fd",
+        "pop": "/usr/share/OVMF/OVMF_CODE_4M.fd",
+        "debian": "/usr/share/OVMF/OVMF_CODE_4M.fd",
+        "linuxmint": "/usr/share/OVMF/OVMF_CODE_4M.fd",
+    }
+    VM_IMAGES_DIR = "/var/lib/libvirt/images"
+    # virt-install argv; placeholders are filled per VM by build_virt_install_cmd.
+    VIRT_INSTALL_TEMPLATE = (
+        "sudo", "virt-install",
+        "--connect", "qemu:///system",
+        "--name", "{vm_name}",
+        "--ram", "{ram}",
+        "--vcpus", "{vcpus}",
+        "--cpu", "{cpu}",
+        "--os-type", "windows",
+        "--os-variant", "win10",
+        "--network", "network=default",
+        "--graphics", "spice",
+        "--cdrom", "{iso_path}",
+        "--disk", "{disk}",
+        "--controller", "type=scsi,model=virtio-scsi",
+        "--machine", "type=pc-q35-6.2",
+        "--boot", "{boot}",
+        "--memballoon", "model=virtio",
+    )
     REQUIRED_PACKAGES = [
         "qemu-system-x86", "libvirt-clients", "libvirt-daemon-system",
-        "libvirt-daemon-config-network", "bridge-utils", "virt-manager", "ovmf", "wimtools"
+        "libvirt-daemon-config-network", "bridge-utils", "virt-manager", "ovmf", "wimtools",
+        "xorriso", "p7zip-full", "qemu-utils"
     ]
 
-    def __init__(self):
+    def __init__(self, vm_names: Optional[List[str]] = None, max_parallel: Optional[int] = None,
+                 base_image: Optional[str] = None, auto_allocate: Optional[bool] = None, transient: bool = False):
         """Initialize the script."""
-        self.init_temp_dirs()  
-
-    def init_temp_dirs(self):
-        """Initialize temporary directories."""
-        self.temp_dir = TemporaryDirectory()
-        self.wimtemp_dir = TemporaryDirectory()
-        self.drivers_dir = TemporaryDirectory()
-        self.windows_dir = TemporaryDirectory()
-        self.virtio_mount_dir = TemporaryDirectory()
-        self.windows_mount_dir = TemporaryDirectory()
+        self.vm_names = vm_names or ["MyVM"]
+        self.max_parallel = max_parallel
+        self.base_image = os.path.abspath(base_image) if base_image else None
+        self._auto_allocate = auto_allocate
+        self.transient = transient
+        self.user = getpass.getuser()
+        self._executor = None
+        self._cpu_topology = None
+        self._mounts = None
+        self._resources = None
+        self._cpu_topology_args = {}
+        self._iso_stats = {}
+        self._numa_nodes = None
+        self._numa_claimed_mb = {}
+        self._numa_lock = threading.Lock()
+        self._nvram_dir = None
+        self._nvram_lock = threading.Lock()
+        self.UEFI_PATH = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """Shared thread pool for I/O-bound work, created on first use."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=min(16, (os.cpu_count() or 1) * 4))
+        return self._executor
+
+    # Temporary directories are created on first access, so paths that never
+    # build a custom ISO never touch /tmp.
+    @functools.cached_property
+    def temp_dir(self) -> TemporaryDirectory:
+        return TemporaryDirectory()
+
+    @functools.cached_property
+    def drivers_dir(self) -> TemporaryDirectory:
+        return TemporaryDirectory()
+
+    @functools.cached_property
+    def windows_dir(self) -> TemporaryDirectory:
+        return TemporaryDirectory()
 
     def main(self) -> None:
         self.log(logging.INFO, "Starting the main sequence of the script.")
+        # Prime the sudo credential cache once so the sudo-prefixed commands below don't re-prompt.
+        self.run_subprocess(["sudo", "-v"], "Failed to obtain sudo credentials.")
         self.log(logging.INFO, "Prompting for ISO choice.")
         provided_win_iso, _, _, user_choice = self.prompt_for_iso_choice()
 
         self.log(logging.INFO, "Installing required packages.")
         self.install_packages(self.REQUIRED_PACKAGES)
 
+        # OVMF is one of the required packages, so the firmware can only be checked once they are installed.
+        self.validate_uefi_path()
+
         self.log(logging.INFO, "Handling user's ISO choice.")
         if user_choice == "1":
             final_win_iso_path = self.handle_user_provided_iso(provided_win_iso)
@@ -61,7 +153,10 @@ class Stage1(EntireScript):
 
         self.setup_libvirt()
 
-        self.create_vm("MyVM", final_win_iso_path)
+        if len(self.vm_names) > 1:
+            self.create_vms([(vm_name, final_win_iso_path) for vm_name in self.vm_names], self.max_parallel)
+        else:
+            self.create_vm(self.vm_names[0], final_win_iso_path)
 
     def fail(self, msg: str, exception: Exception = None) -> None:
         if exception:
@@ -71,27 +166,23 @@ class Stage1(EntireScript):
         sys.exit(1)
 
 
-    def run_subprocess(self, cmd: List[str], fail_msg: str) -> None:
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Command failed. Error: {e.stderr}")
-            raise Exception(fail_msg)
-
-    def clear_directory(self, dir_path: str) -> None:
-        for filename in os.listdir(dir_path):
-            file_path = os.path.join(dir_path, filename)
-            try:
-                if os.path.isfile(file_path):
-                    os.unlink(file_path)
-                elif os.path.isdir(file_path):
-                    shutil.rmtree(file_path)
-            except Exception as e:
-                logging.error(f"Failed to delete {file_path}. Reason: {e}")
-                
+    def run_subprocess(self, cmd: List[str], fail_msg: str, capture: bool = False) -> Optional[str]:
+        """Run a command, returning its stdout only when capture is requested."""
+        stdout = subprocess.PIPE if capture else subprocess.DEVNULL
+        # stderr is spooled to an anonymous file and only read back if the command fails.
+        with TemporaryFile() as stderr:
+            # Python opens its own fds non-inheritable (PEP 446), so skipping the close_fds sweep is safe.
+            result = subprocess.run(cmd, stdout=stdout, stderr=stderr, text=True, close_fds=False)
+            if result.returncode != 0:
+                stderr.seek(0)
+                logging.error(f"Command failed. Error: {stderr.read().decode(errors='replace')}")
+                raise Exception(fail_msg)
+        return result.stdout
+
     def sudo_tee_write(self, file_path, content):
         try:
-            process = subprocess.run(["sudo", "tee", file_path], input=content, text=True, check=True, capture_output=True)
+            process = subprocess.run(["sudo", "tee", file_path], input=content, text=True, check=True,
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
             if process.returncode != 0:
                 raise Exception(f"Failed to write to {file_path} using sudo tee")
         except Exception as e:
@@ -100,19 +191,22 @@ class Stage1(EntireScript):
 
     def sudo_cat_read(self, file_path):
         try:
-            process = subprocess.run(["sudo", "cat", file_path], text=True, capture_output=True, check=True)
-            return process.stdout
+            return self.run_subprocess(["sudo", "cat", file_path], f"Failed to read {file_path}", capture=True)
         except Exception as e:
             self.fail(f"Failed to read {file_path}. Error: {e}")
             raise Exception(f"Exiting due to failure in reading {file_path}")
         
     def cleanup_temp_dirs(self):
-        """Cleanup the temporary directories."""
-        for temp_dir in [self.temp_dir, self.drivers_dir, self.windows_dir, self.virtio_mount_dir, self.windows_mount_dir]:
+        """Cleanup the temporary directories created so far; they are recreated on next access."""
+        # Take one fresh mountinfo snapshot per cleanup pass.
+        self._mounts = None
+        for attr, temp_dir in list(self.__dict__.items()):
+            if not isinstance(temp_dir, TemporaryDirectory):
+                continue
             if self.is_mounted(Path(temp_dir.name)):
                 self.unmount(Path(temp_dir.name))
             temp_dir.cleanup()
-        self.init_temp_dirs()
+            del self.__dict__[attr]
 
     def prompt_for_iso_choice(self) -> Tuple[str, str, str, str]:
         """Prompt the user to select an ISO option and return the selected values."""
@@ -156,10 +250,7 @@ class Stage1(EntireScript):
         self.log(logging.INFO, "Create custom ISO with VirtIO drivers.")
         self.cleanup_temp_dirs()
         try:
-            actual_virtio_url = self.get_redirected_url(self.VIRTIO_ISO_URL)
-            virtio_iso = os.path.basename(urlsplit(actual_virtio_url).path)
-
-            self.download_file(actual_virtio_url, virtio_iso)
+            virtio_iso = self.fetch_virtio_iso()
             custom_iso_path = self.create_custom_iso(provided_win_iso, virtio_iso)
 
             return custom_iso_path
@@ -170,7 +261,7 @@ class Stage1(EntireScript):
         """Handle the case where the user opts to download a new ISO."""
         self.log(logging.INFO, "Starting to handle downloaded ISO.")
         #self.check_disk_space()
-        self.download_file("https://raw.githubusercontent.com/ElliotKillick/Mido/main/Mido.sh", "Mido.sh")
+        virtio_iso = self.fetch_virtio_iso([("https://raw.githubusercontent.com/ElliotKillick/Mido/main/Mido.sh", "Mido.sh")])
         self.log(logging.INFO, "Custom ISO created successfully.")
         os.chmod("Mido.sh", 0o755)
  
@@ -182,39 +273,57 @@ class Stage1(EntireScript):
         if not os.path.isfile(downloaded_win_iso):
             self.fail(f"{downloaded_win_iso} not found. Something went wrong.")
  
-        virtio_iso_url = "https://fedorapeople.org/groups/virt/virtio-win/direct-downloads/latest-virtio/virtio-win.iso"
-        actual_virtio_url = self.get_redirected_url(virtio_iso_url)
-        virtio_iso = os.path.basename(urlsplit(actual_virtio_url).path)
- 
-        self.download_file(actual_virtio_url, virtio_iso)
- 
         custom_iso_path = self.create_custom_iso(downloaded_win_iso, virtio_iso)
         print("Custom ISO Created")
         return custom_iso_path
  
+    def fetch_virtio_iso(self, extra_jobs: List[Tuple[str, str]] = ()) -> str:
+        """Download the VirtIO ISO alongside extra_jobs, skipping it if a copy matching its SHA-256 sidecar is cached."""
+        actual_virtio_url = self.resolved_virtio_url
+        virtio_iso = os.path.basename(urlsplit(actual_virtio_url).path)
+        virtio_sha256 = self.fetch_sha256(actual_virtio_url)
+        virtio_cached = (virtio_sha256 is not None and os.path.isfile(virtio_iso)
+                         and self.verify_sha256(virtio_iso, virtio_sha256))
+
+        jobs = list(extra_jobs)
+        if virtio_cached:
+            self.log(logging.INFO, "%s already downloaded and verified. Skipping download.", virtio_iso)
+        else:
+            jobs.append((actual_virtio_url, virtio_iso))
+        self.download_files(jobs)
+
+        if virtio_sha256 is not None and not virtio_cached and not self.verify_sha256(virtio_iso, virtio_sha256):
+            self.fail(f"SHA-256 mismatch for {virtio_iso}.")
+        return virtio_iso
+
+    @functools.cached_property
+    def resolved_virtio_url(self) -> str:
+        """VIRTIO_ISO_URL after following redirects, resolved once per run."""
+        return self.get_redirected_url(self.VIRTIO_ISO_URL)
+
     def get_redirected_url(self, url: str) -> str:
         try:
-            self.log(logging.DEBUG, f"Debug: Getting redirected URL for {url}.")
-            return subprocess.check_output(["curl", "-sIL", "-o", "/dev/null", "-w", "%{url_effective}", url]).decode().strip()
+            self.log(logging.DEBUG, "Debug: Getting redirected URL for %s.", url)
+            # The stock redirect handler re-issues redirected HEADs as GETs, which would start the full download.
+            with build_opener(_HeadRedirectHandler).open(Request(url, method="HEAD")) as response:
+                return response.url
         except Exception as e:
-            self.log(logging.ERROR, f"Error in get_redirected_url: {e}")
+            self.log(logging.ERROR, "Error in get_redirected_url: %s", e)
             self.fail(f"Failed to get redirected URL. Error: {e}", e)
  
     def create_custom_iso(self, win_iso: str, virtio_iso: str) -> str:
-        mounted_isos = []
         try:
             self.prepare_directories_for_custom_iso()
-            self.copy_virtio_drivers(virtio_iso)
-            mounted_isos.append(self.virtio_mount_dir.name)
-            self.copy_windows_files(win_iso)
-            mounted_isos.append(self.windows_mount_dir.name)
+            futures = [
+                self.executor.submit(self.copy_virtio_drivers, virtio_iso),
+                self.executor.submit(self.copy_windows_files, win_iso),
+            ]
+            for future in as_completed(futures):
+                future.result()
             self.add_drivers_to_windows_boot_images()
             return self.generate_custom_iso()
         except Exception as e:
             self.fail(f"Failed to create custom ISO. Error: {e}", e)
-        finally:
-            for iso in mounted_isos:
-                self.unmount(iso)
  
     def prepare_directories_for_custom_iso(self) -> None:
         """Prepare directories needed for creating a custom ISO."""
@@ -222,9 +331,6 @@ class Stage1(EntireScript):
             self.temp_dir,
             self.drivers_dir,
             self.windows_dir,
-            self.virtio_mount_dir,
-            self.windows_mount_dir,
-            self.wimtemp_dir,
         ]:
             dir_path = Path(temp_dir.name)
             if dir_path.exists():
@@ -235,90 +341,87 @@ class Stage1(EntireScript):
         """Copy VirtIO drivers from the VirtIO ISO."""
         self.log(logging.INFO, "Copying over VirtIO drivers.")
         try:
-            self.mount_iso(virtio_iso, self.virtio_mount_dir.name)
-            self.copy_tree(self.virtio_mount_dir.name, self.drivers_dir.name)
-            self.unmount(self.virtio_mount_dir.name)
+            self.extract_iso(virtio_iso, self.drivers_dir.name)
         except Exception as e:
-            self.log(logging.ERROR, f"Error in copy_virtio_drivers: {e}")
+            self.log(logging.ERROR, "Error in copy_virtio_drivers: %s", e)
             self.fail(f"Failed to copy VirtIO drivers. Error: {e}", e)
  
     def copy_windows_files(self, win_iso: str) -> None:
         """Copy Windows files from the Windows ISO."""
         self.log(logging.INFO, "Copying over Windows files.")
         try:
-            self.mount_iso(win_iso, self.windows_mount_dir.name) 
-            self.copy_tree(self.windows_mount_dir.name, self.windows_dir.name)
-            self.unmount(self.windows_mount_dir.name)
+            self.extract_iso(win_iso, self.windows_dir.name)
         except Exception as e:
-            self.log(logging.ERROR, f"Error in copy_windows_files: {e}")
+            self.log(logging.ERROR, "Error in copy_windows_files: %s", e)
             self.fail(f"Failed to copy Windows files. Error: {e}", e)
  
     def add_drivers_to_windows_boot_images(self) -> None:
         """Add drivers to Windows boot images."""
         self.log(logging.INFO, "Adding drivers to Windows boot images.")
+        # wimlib locks a WIM for writing, so the images are updated one after another.
         for image_index in [1, 2]:
-            self.mount_wim(f"{self.windows_dir.name}/sources/boot.wim", image_index)
-            self.copy_tree(self.drivers_dir.name, self.wimtemp_dir.name)
-            self.unmount_wim()
+            self.update_wim(f"{self.windows_dir.name}/sources/boot.wim", image_index, self.drivers_dir.name)
  
     def generate_custom_iso(self) -> str:
         """Generate a custom ISO containing both Windows and VirtIO drivers."""
         self.log(logging.INFO, "Generating custom ISO.")
-        mkisofs_command = [
-            "sudo", "mkisofs", "-allow-limited-size", "-o", "CustomWin10.iso", "-b", "boot/etfsboot.com", "-no-emul-boot",
-            "-boot-load-seg", "0x07C0", "-boot-load-size", "8", "-iso-level", "2", "-J", "-l", "-D", "-N", "-joliet-long",
-            "-relaxed-filenames", "-V", "Custom Win10", "-allow-lowercase", "-hide", "boot.catalog", self.windows_dir.name
+        xorrisofs_command = [
+            "sudo", "xorrisofs", "-iso-level", "3", "-J", "-joliet-long", "-rational-rock", "-V", "Custom Win10",
+            "-b", "boot/etfsboot.com", "-no-emul-boot", "-boot-load-seg", "0x07C0", "-boot-load-size", "8",
+            "-o", "CustomWin10.iso", self.windows_dir.name
         ]
-        self.run_subprocess(mkisofs_command, "Failed to create custom ISO.")
+        self.run_subprocess(xorrisofs_command, "Failed to create custom ISO.")
         self.log(logging.INFO, "Custom ISO generated successfully.")
         return "CustomWin10.iso"
  
     def download_file(self, url: str, dest: str) -> None: 
         try:
             dest_path = Path(dest)  
-            self.log(logging.DEBUG, f"Debug: Downloading file from {url} to {dest_path}.")
-            urlretrieve(url, dest_path)
-            if not dest_path.exists():
-                self.fail(f"Download failed, file {dest_path} does not exist.")
-            self.log(logging.INFO, f"Successfully downloaded from {url} to {dest_path}.")
+            self.log(logging.DEBUG, "Debug: Downloading file from %s to %s.", url, dest_path)
+            with urlopen(url) as response, open(dest_path, "wb") as out:
+                expected = response.headers.get("Content-Length")
+                shutil.copyfileobj(response, out, 1 << 20)
+                # copyfileobj stops quietly at EOF, so a dropped connection would otherwise leave a truncated file.
+                if expected is not None and out.tell() < int(expected):
+                    raise ContentTooShortError(f"retrieval incomplete: got only {out.tell()} out of {expected} bytes", None)
+            self.log(logging.INFO, "Successfully downloaded from %s to %s.", url, dest_path)
         except Exception as e:
-            self.log(logging.ERROR, f"Error in download_file: {e}")
+            self.log(logging.ERROR, "Error in download_file: %s", e)
             self.fail(f"Failed to download {dest_path}. Error: {e}", e)
+
+    def download_files(self, jobs: List[Tuple[str, str]]) -> None:
+        """Download several (url, dest) pairs concurrently on the shared executor."""
+        futures = [self.executor.submit(self.download_file, url, dest) for url, dest in jobs]
+        for future in as_completed(futures):
+            future.result()
  
-    def mount_iso(self, iso_path: Union[str, Path], mount_point: Union[str, Path]) -> None:
-        """Enhanced ISO mount method with improved error handling."""
- 
-        iso_path = Path(iso_path)
-        mount_point = Path(mount_point) 
-        
-        if not isinstance(iso_path, Path):
-            self.log(logging.ERROR, f"iso_path is not a Path object. It's a {type(iso_path)}.")
-            return
- 
-        if not isinstance(mount_point, Path):
-            self.log(logging.ERROR, f"mount_point is not a Path object. It's a {type(mount_point)}.")
-            return
- 
-        if not iso_path.exists():
-            self.log(logging.ERROR, f"ISO path {iso_path} does not exist.")
-            return
- 
-        if not mount_point.exists():
-            self.log(logging.ERROR, f"Mount point {mount_point} does not exist.")
-            return
- 
-        cmd = ["sudo", "mount", "-o", "loop", str(iso_path), str(mount_point)]
- 
+    def fetch_sha256(self, url: str) -> Optional[str]:
+        """Fetch the published .sha256 sidecar for a URL, or None if there is none."""
         try:
-            self.run_subprocess(cmd, f"Failed to mount {iso_path} to {mount_point}")
-            if not any(mount_point.iterdir()):
-                self.fail(f"Failed to mount {iso_path} to {mount_point}. The directory is empty.")
-            self.log(logging.INFO, f"Successfully mounted {iso_path} to {mount_point}.")
+            with urlopen(f"{url}.sha256") as response:
+                return response.read().decode().split()[0].lower()
         except Exception as e:
+            self.log(logging.WARNING, "No SHA-256 checksum available for %s: %s", url, e)
+            return None
+
+    def verify_sha256(self, path: Union[str, Path], expected: str) -> bool:
+        """Check whether a file's SHA-256 digest matches the expected hex digest."""
+        with open(path, "rb") as f:
+            if hasattr(hashlib, "file_digest"):
+                return hashlib.file_digest(f, "sha256").hexdigest() == expected
+            # hashlib.file_digest is Python 3.11+; hash in 1 MiB chunks on older interpreters.
+            digest = hashlib.sha256()
+            for chunk in iter(functools.partial(f.read, 1 << 20), b""):
+                digest.update(chunk)
+            return digest.hexdigest() == expected
+
+    def extract_iso(self, iso_path: Union[str, Path], dest: Union[str, Path]) -> None:
+        """Extract the contents of an ISO with 7z, without loop-mounting it."""
+        # Windows ISOs keep their files in the UDF layer (ISO9660 only holds a README stub), which 7z reads.
+        cmd = ["7z", "x", "-y", f"-o{dest}", str(iso_path)]
+        self.run_subprocess(cmd, f"Failed to extract {iso_path} to {dest}")
+        self.log(logging.INFO, "Successfully extracted %s to %s.", iso_path, dest)
 
-            self.log(logging.ERROR, f"Debug Info: ISO Path exists: {iso_path.exists()}, Mount Point exists: {mount_point.exists()}")
-            self.fail(f"Failed to mount {iso_path} to {mount_point}", e)
- 
     def unmount(self, mount_point: Path) -> None:
         """Enhanced unmount method with improved error handling."""
  
@@ -327,64 +430,37 @@ class Stage1(EntireScript):
  
         cmd = ["sudo", "umount", str(mount_point)]
         if not self.is_mounted(mount_point):  
-            self.log(logging.WARNING, f"{mount_point} is not mounted.")
+            self.log(logging.WARNING, "%s is not mounted.", mount_point)
             return
         try:
             self.run_subprocess(cmd, f"Failed to unmount {mount_point}")
+            self._mounts = None
             if any(mount_point.iterdir()):
                 self.fail(f"Failed to unmount {mount_point}. The directory is not empty.")
-            self.log(logging.INFO, f"Successfully unmounted {mount_point}.")
+            self.log(logging.INFO, "Successfully unmounted %s.", mount_point)
         except PermissionError:
-            self.log(logging.ERROR, f"Permission error occurred while unmounting {mount_point}")
+            self.log(logging.ERROR, "Permission error occurred while unmounting %s", mount_point)
             self.fail(f"Failed to unmount {mount_point} due to permission error.")
         except Exception as e:
             self.fail(f"Failed to unmount {mount_point}", e)
  
  
     def is_mounted(self, path: Path) -> bool:
-        """Check if a path is a mount point."""
-        return os.path.ismount(path)
- 
- 
-    def mount_wim(self, wim_path: str, index: int) -> None:
-        """Mount a WIM image to a temporary directory."""
-        self.log(logging.INFO, f"Mounting WIM image from {wim_path} at index {index} to {self.wimtemp_dir.name}")
- 
-        # Verify that WIM file exists
-        if not os.path.exists(wim_path):
-            self.log(logging.ERROR, f"WIM file {wim_path} does not exist.")
-            return
+        """Check if a path is a mount point, using a snapshot of /proc/self/mountinfo."""
+        if self._mounts is None:
+            with open("/proc/self/mountinfo") as mountinfo:
+                # Mount points escape whitespace and backslashes as octal, e.g. "\040" for a space; decode only those.
+                self._mounts = {_MOUNTINFO_ESCAPE_RE.sub(lambda m: chr(int(m[1], 8)), line.split()[4])
+                                for line in mountinfo}
+        return os.path.abspath(path) in self._mounts
  
-        # Construct the command
-        cmd = ["sudo", "wimmountrw", wim_path, str(index), self.wimtemp_dir.name]
  
-        try:
-            # Run the command
-            subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            self.log(logging.INFO, "Successfully mounted WIM image.")
- 
-        except subprocess.CalledProcessError as e:
-            self.log(logging.ERROR, f"Failed to mount WIM image. Error: {e.stderr.decode().strip()}")
- 
-    def unmount_wim(self) -> None:
-        """Unmount the WIM image and commit changes."""
-        cmd = ["sudo", "wimunmount", "--commit", self.wimtemp_dir.name]
-        self.run_subprocess(cmd, "Failed to unmount WIM image.")
- 
-    def copy_tree(self, src, dest):
-        try:
-            copytree(src, dest, dirs_exist_ok=True)
-        except FileExistsError:
-            logging.error(f"{dest} already exists.")
-        except PermissionError:
-            logging.error(f"Do not have the necessary permissions to copy to {dest}.")
-        except Exception as e:
-            for src, dst, msg in e.args[0]:
-                # src is source name
-                logging.error(f"Error occurred when copying {src} to {dst}: {msg}")
-        except:
-            logging.error(f"An unexpected error occurred: {e}") 
-            
+    def update_wim(self, wim_path: str, index: int, source_dir: str) -> None:
+        """Add the contents of a directory to the root of a WIM image without mounting it."""
+        self.log(logging.INFO, "Adding %s to WIM image %s at index %s", source_dir, wim_path, index)
+        cmd = ["sudo", "wimupdate", wim_path, str(index), f"--command=add {source_dir} /"]
+        self.run_subprocess(cmd, f"Failed to update WIM image {wim_path} at index {index}.")
+
     def check_disk_space(self, directory: Path) -> None:
         """Check if there's enough disk space in a given directory."""
         try:
@@ -400,15 +476,37 @@ class Stage1(EntireScript):
     def install_packages(self, packages: List[str]) -> None:
         self.log(logging.INFO, "Starting package installation.") 
         """Install required packages if they are not already installed."""
+        # The sentinel records which packages were verified, so a changed package list forces a fresh check.
+        package_list = "\n".join(sorted(packages))
+        try:
+            sentinel_stat = self.PACKAGES_SENTINEL.stat()
+            if (time.time() - sentinel_stat.st_mtime < self.PACKAGES_SENTINEL_MAX_AGE
+                    and self.PACKAGES_SENTINEL.read_text() == package_list):
+                self.log(logging.INFO, "Required packages were verified within the last day. Skipping check.")
+                return
+        except OSError:
+            pass
         self.log(logging.INFO, "Checking if required packages are already installed...")
-        all_installed = all(subprocess.call(["dpkg-query", "-W", "-f=${Status}", package], stdout=subprocess.DEVNULL) == 0 for package in packages)
+        # A nonzero exit only means some packages are unknown to dpkg.
+        result = subprocess.run(["dpkg-query", "-W", "-f=${Package}\t${Status}\n", *packages], capture_output=True, text=True)
+        statuses = dict(line.split("\t", 1) for line in result.stdout.splitlines() if "\t" in line)
+        all_installed = all(statuses.get(package, "").endswith(" installed") for package in packages)
  
         if not all_installed:
             self.log(logging.INFO, "Installing required packages...")
-            self.run_subprocess(["sudo", "apt", "update"], "Failed to update package list.")
-            self.run_subprocess(["sudo", "apt", "install", "-y"] + packages, "Failed to install packages.")
+            # stdout is discarded, so a debconf prompt would hang the run unseen; keep every apt/dpkg call noninteractive.
+            noninteractive = ["sudo", "env", "DEBIAN_FRONTEND=noninteractive"]
+            apt_get = noninteractive + ["apt-get"]
+            self.run_subprocess(apt_get + ["update"], "Failed to update package list.")
+            # Defer dpkg triggers (man-db, initramfs, ...) to a single pass after the install.
+            self.run_subprocess(apt_get + ["install", "-y", "--no-install-recommends",
+                                           "-o", "Dpkg::Options::=--no-triggers"] + packages,
+                                "Failed to install packages.")
+            self.run_subprocess(noninteractive + ["dpkg", "--configure", "-a"], "Failed to finalize dpkg triggers.")
         else:
             self.log(logging.INFO, "All required packages are already installed.")
+        self.PACKAGES_SENTINEL.parent.mkdir(parents=True, exist_ok=True)
+        self.PACKAGES_SENTINEL.write_text(package_list)
         self.log(logging.INFO, "Finished package installation.")
        
     def setup_libvirt(self) -> None:
@@ -425,8 +523,7 @@ class Stage1(EntireScript):
     def add_user_to_libvirt_and_kvm_groups(self) -> None:
         """Add the current user to the kvm and libvirt groups."""
         try:
-            user = getpass.getuser()
-            self.run_subprocess(["sudo", "usermod", "-a", "-G", "kvm,libvirt", user],
+            self.run_subprocess(["sudo", "usermod", "-a", "-G", "kvm,libvirt", self.user],
                                 "Failed to add the user to kvm and libvirt groups.")
         except Exception as e:
             self.fail(f"Failed to add user to kvm and libvirt groups. Error: {e}") 
@@ -445,23 +542,40 @@ class Stage1(EntireScript):
         try:
             if os.path.exists(file_path):
                 backup_path = f"{file_path}.backup"
-                subprocess.run(["sudo", "cp", file_path, backup_path])
-                self.log(logging.INFO, f"Backup of {file_path} created.")
+                if os.geteuid() == 0:
+                    shutil.copy2(file_path, backup_path)
+                else:
+                    subprocess.run(["sudo", "cp", "--preserve=all", file_path, backup_path], check=True)
+                self.log(logging.INFO, "Backup of %s created.", file_path)
             else:
-                self.log(logging.WARNING, f"File {file_path} does not exist, skipping backup.")
+                self.log(logging.WARNING, "File %s does not exist, skipping backup.", file_path)
         except Exception as e:
             self.fail(f"Failed to create backup of {file_path}. Error: {e}")
 
-    def modify_config(self, file_path, search_string, replace_string):
+    def modify_config(self, file_path: str, replacements: List[Tuple[str, str]], additional_settings: str = "") -> None:
+        """Apply replacements and append missing settings with a single read and write."""
         try:
             filedata = self.sudo_cat_read(file_path) 
-
-            if search_string in filedata:
-                filedata = filedata.replace(search_string, replace_string)
+            original_filedata = filedata
+
+            for search_string, replace_string in replacements:
+                if search_string in filedata:
+                    filedata = filedata.replace(search_string, replace_string)
+                else:
+                    self.log(logging.WARNING, "Search string '%s' not found in %s", search_string, file_path)
+
+            if additional_settings:
+                if all(line in filedata for line in additional_settings.splitlines()):
+                    self.log(logging.INFO, "Additional settings already exist in %s. Skipping.", file_path)
+                else:
+                    self.log(logging.INFO, "Appending additional settings to %s...", file_path)
+                    if filedata and not filedata.endswith("\n"):
+                        filedata += "\n"
+                    filedata += additional_settings
+
+            if filedata != original_filedata:
                 self.sudo_tee_write(file_path, filedata)
-                self.log(logging.INFO, f"Modified {file_path}.")
-            else:
-                self.log(logging.WARNING, f"Search string '{search_string}' not found in {file_path}")
+                self.log(logging.INFO, "Modified %s.", file_path)
 
         except Exception as e:
             self.fail(f"Failed to modify {file_path}. Error: {e}")
@@ -484,28 +598,11 @@ class Stage1(EntireScript):
                 self.log(logging.INFO, "Backup file already exists. Skipping backup.")
 
             self.log(logging.INFO, "Modifying libvirt configuration...")
-            self.modify_config(libvirt_config_path, "#unix_sock_group = \"libvirt\"", "unix_sock_group = \"libvirt\"")
-            self.modify_config(libvirt_config_path, "#unix_sock_rw_perms = \"0770\"", "unix_sock_rw_perms = \"0770\"")
-
-            self.log(logging.INFO, "Checking if additional settings already exist in libvirt configuration...")
-            additional_settings_exist = True
             additional_settings = 'log_filters="3:qemu 1:libvirt"\nlog_outputs="2:file:/var/log/libvirt/libvirtd.log"\n'
-
-            with open(libvirt_config_path, 'r') as file:
-                file_contents = file.read()
-                for line in additional_settings.strip().split('\n'):
-                    if line not in file_contents:
-                        additional_settings_exist = False
-                        break
-
-            if not additional_settings_exist:
-                self.log(logging.INFO, "Appending additional settings to libvirt configuration...")
-                with open("/tmp/additional_libvirt_settings", "w") as temp_file:
-                    temp_file.write(additional_settings)
-                subprocess.run(["sudo", "tee", "-a", libvirt_config_path], input=open("/tmp/additional_libvirt_settings").read(), text=True, check=True)
-                os.remove("/tmp/additional_libvirt_settings")
-            else:
-                self.log(logging.INFO, "Additional settings already exist in libvirt configuration. Skipping.")
+            self.modify_config(libvirt_config_path, [
+                ("#unix_sock_group = \"libvirt\"", "unix_sock_group = \"libvirt\""),
+                ("#unix_sock_rw_perms = \"0770\"", "unix_sock_rw_perms = \"0770\""),
+            ], additional_settings)
 
             self.log(logging.INFO, "Libvirt configuration successfully modified and backed up.")
         except Exception as e:
@@ -535,10 +632,10 @@ class Stage1(EntireScript):
                 self.log(logging.INFO, "Backup file already exists. Skipping backup.")
 
             self.log(logging.INFO, "Modifying qemu configuration...")
-            user = getpass.getuser()
-
-            self.modify_config(qemu_config_path, "#user = \"root\"", f"user = \"{user}\"")
-            self.modify_config(qemu_config_path, "#group = \"root\"", "group = \"libvirt\"")
+            self.modify_config(qemu_config_path, [
+                ("#user = \"root\"", f"user = \"{self.user}\""),
+                ("#group = \"root\"", "group = \"libvirt\""),
+            ])
 
             self.log(logging.INFO, "qemu configuration successfully modified and backed up.")
         except Exception as e:
@@ -551,76 +648,97 @@ class Stage1(EntireScript):
         self.run_subprocess(["sudo", "virsh", "net-autostart", "default"],
                             "Failed to enable the default network for virsh.")
  
+    @functools.cached_property
+    def user_groups(self) -> List[str]:
+        """Names of the groups the current user belongs to, looked up once."""
+        primary_gid = pwd.getpwnam(self.user).pw_gid
+        return [grp.getgrgid(gid).gr_name for gid in os.getgrouplist(self.user, primary_gid)]
+
     def verify_user_groups(self) -> None:
         """Verify and log the groups the current user belongs to."""
-        user = getpass.getuser()
-        user_groups = ', '.join([g.gr_name for g in grp.getgrall() if user in g.gr_mem])
-        self.log(logging.INFO, f"User groups: {user_groups}")
+        self.log(logging.INFO, "User groups: %s", ", ".join(self.user_groups))
  
     def resource_assessment(self) -> Tuple[int, int, int]:
+        """Return available RAM (MB), CPUs and disk (GB), probed once per run."""
+        if self._resources is not None:
+            return self._resources
         try:
-            with open('/proc/meminfo') as f:
-                meminfo = {i.split()[0].rstrip(':'): int(i.split()[1]) for i in f.readlines()}
-
-            available_ram_mb = meminfo['MemAvailable'] // 1024
-            available_cpus = os.cpu_count()
-            statvfs = os.statvfs('/var/lib/libvirt/images/')
+            meminfo = Path('/proc/meminfo').read_bytes()
+            available_ram_mb = int(_MEMAVAIL_RE.search(meminfo).group(1)) // 1024
+            available_cpus = len(os.sched_getaffinity(0))
+            statvfs = os.statvfs(self.VM_IMAGES_DIR)
             available_disk_gb = (statvfs.f_frsize * statvfs.f_bavail) // (1024 * 1024 * 1024)
 
         except Exception as e:
             self.fail(f"Failed to assess system resources. Error: {e}")
 
-        return available_ram_mb, available_cpus, available_disk_gb
+        self._resources = (available_ram_mb, available_cpus, available_disk_gb)
+        return self._resources
 
     def auto_or_manual_config(self) -> str:
-        """Prompt the user to decide between automatic or manual resource allocation."""
-        return input("Do you want to automatically allocate resources? (y/n): ")
- 
-    def auto_allocation(self, available_ram_mb: int, available_cpus: int, available_disk_gb: int) -> Tuple[int, int, int]:
-        """Automatically allocate system resources based on availability."""
+        """Return 'y' for automatic or 'n' for manual allocation, prompting at most once per run."""
+        if self._auto_allocate is None:
+            self._auto_allocate = input("Do you want to automatically allocate resources? (y/n): ").lower() == 'y'
+        return 'y' if self._auto_allocate else 'n'
+ 
+    def auto_allocation(self, available_ram_mb: int, available_cpus: int, available_disk_gb: int,
+                        vm_count: int = 1) -> Tuple[int, int, int]:
+        """Automatically allocate per-VM system resources, splitting half of what is available across vm_count VMs."""
         try:
             self.log(logging.INFO, "Automatically allocating resources...")
  
-            allocated_ram = available_ram_mb // 2
-            allocated_cpus = available_cpus // 2
-            allocated_disk = available_disk_gb // 2
- 
-            self.log(logging.INFO, f"Allocated RAM: {allocated_ram}MB")
-            self.log(logging.INFO, f"Allocated CPU cores: {allocated_cpus}")
-            self.log(logging.INFO, f"Allocated Disk Space: {allocated_disk}GB")
+            allocated_ram = available_ram_mb // 2 // vm_count
+            threads_per_core, sockets, _ = self.get_cpu_topology()
+            cpu_step = threads_per_core * sockets
+            # Round down to a whole number of cores per socket so the guest topology is exact. If half the
+            # host is less than one step, use up to all of this VM's share rather than exceeding it.
+            cpu_share = available_cpus // vm_count
+            allocated_cpus = (cpu_share // 2 // cpu_step or cpu_share // cpu_step) * cpu_step
+            allocated_disk = available_disk_gb // 2 // vm_count
+ 
+            self.log(logging.INFO, "Allocated RAM: %sMB", allocated_ram)
+            self.log(logging.INFO, "Allocated CPU cores: %s", allocated_cpus)
+            self.log(logging.INFO, "Allocated Disk Space: %sGB", allocated_disk)
         except Exception as e:
             self.fail(f"Failed to automatically allocate resources. Error: {e}")
  
         return allocated_ram, allocated_cpus, allocated_disk
  
-    def manual_allocation(self, available_ram_mb: int, available_cpus: int, available_disk_gb: int) -> Tuple[int, int, int]:
-        """Manually allocate system resources based on user input."""
+    def manual_allocation(self, available_ram_mb: int, available_cpus: int, available_disk_gb: int,
+                          vm_count: int = 1) -> Tuple[int, int, int]:
+        """Manually allocate per-VM system resources based on user input."""
         try:
-            allocated_ram = int(input(f"Enter the amount of RAM to allocate (suggested: {available_ram_mb // 2}MB): "))
-            allocated_cpus = int(input(f"Enter the number of CPU cores to allocate (suggested: {available_cpus // 2}): "))
-            allocated_disk = int(input(f"Enter the amount of disk space to allocate (suggested: {available_disk_gb // 2}GB): "))
- 
-            if allocated_ram > available_ram_mb or allocated_cpus > available_cpus or allocated_disk > available_disk_gb:
-                self.fail("Invalid resource allocation.")
+            allocated_ram = int(input(f"Enter the amount of RAM to allocate per VM (suggested: {available_ram_mb // 2 // vm_count}MB): "))
+            allocated_cpus = int(input(f"Enter the number of CPU cores to allocate per VM (suggested: {available_cpus // 2 // vm_count}): "))
+            allocated_disk = int(input(f"Enter the amount of disk space to allocate per VM (suggested: {available_disk_gb // 2 // vm_count}GB): "))
         except Exception as e:
             self.fail(f"Failed to manually allocate resources. Error: {e}")
         return allocated_ram, allocated_cpus, allocated_disk
  
+    @functools.cached_property
+    def distro(self) -> str:
+        """The ID field of /etc/os-release, read once per run."""
+        match = _DISTRO_RE.search(Path('/etc/os-release').read_bytes())
+        return match.group(1).strip(b'"').decode() if match else ""
+
     def get_uefi_path(self) -> str:
         """Get the UEFI firmware path based on the Linux distribution."""
-        DISTRO_NAME = re.search(r'^ID=(.*)$', open('/etc/os-release').read(), re.MULTILINE).group(1)
-        if DISTRO_NAME in ["ubuntu", "pop", "debian", "linuxmint"]:
-            return "/usr/share/OVMF/OVMF_CODE_4M.fd"
-        else:
+        uefi_path = self.UEFI_PATHS.get(self.distro)
+        if uefi_path is None:
             self.fail("Unsupported Linux distribution for UEFI firmware.")
+        return uefi_path
  
     def get_cpu_topology(self) -> Tuple[int, int, int]:
-        """Get CPU topology information from the system."""
-        lscpu_output = subprocess.check_output(["lscpu"]).decode()
-        threads_per_core = int(re.search(r'Thread\(s\) per core:\s*(\d+)', lscpu_output).group(1))
-        sockets = int(re.search(r'Socket\(s\):\s*(\d+)', lscpu_output).group(1))
-        numa_nodes = int(re.search(r'NUMA node\(s\):\s*(\d+)', lscpu_output).group(1))
-        return threads_per_core, sockets, numa_nodes
+        """Get CPU topology information from sysfs, cached after the first call."""
+        if self._cpu_topology is None:
+            topology_dirs = glob("/sys/devices/system/cpu/cpu[0-9]*/topology")
+            siblings = {Path(d, "thread_siblings_list").read_text().strip() for d in topology_dirs}
+            packages = {Path(d, "physical_package_id").read_text().strip() for d in topology_dirs}
+            threads_per_core = len(topology_dirs) // max(len(siblings), 1)
+            sockets = len(packages)
+            numa_nodes = max(len(glob("/sys/devices/system/node/node[0-9]*")), 1)
+            self._cpu_topology = (threads_per_core, sockets, numa_nodes)
+        return self._cpu_topology
  
     def validate_allocation(self, allocated_ram: int, allocated_cpus: int, allocated_disk: int,
                             available_ram_mb: int, available_cpus: int, available_disk_gb: int) -> None:
@@ -629,69 +747,257 @@ class Stage1(EntireScript):
             self.fail("Invalid resource allocation.")
  
     def validate_uefi_path(self) -> None:
-        """Validate the UEFI path based on the Linux distribution."""
-        UEFI_PATH = self.get_uefi_path()
-        if not os.path.isfile(UEFI_PATH):
-            self.fail(f"UEFI firmware not found at specified path: {UEFI_PATH}")
- 
-    def allocate_resources(self) -> Tuple[int, int, int]:
-        """Allocate system resources for the VM."""
+        """Validate the UEFI firmware once per run and record its path as self.UEFI_PATH."""
+        if self.UEFI_PATH is not None:
+            return
+        uefi_path = self.get_uefi_path()
+        try:
+            uefi_stat = os.stat(uefi_path)
+        except OSError as e:
+            self.fail(f"UEFI firmware not found at specified path: {uefi_path} ({e.strerror})")
+        if not stat.S_ISREG(uefi_stat.st_mode):
+            self.fail(f"UEFI firmware at {uefi_path} is not a regular file.")
+        self.UEFI_PATH = uefi_path
+ 
+    def allocate_resources(self, vm_count: int = 1) -> Tuple[int, int, int]:
+        """Allocate and validate per-VM system resources for vm_count identical VMs."""
         available_ram_mb, available_cpus, available_disk_gb = self.resource_assessment()
         auto_allocate = self.auto_or_manual_config()
  
         if auto_allocate.lower() == 'y':
-            return self.auto_allocation(available_ram_mb, available_cpus, available_disk_gb)
+            allocated_ram, allocated_cpus, allocated_disk = self.auto_allocation(available_ram_mb, available_cpus, available_disk_gb, vm_count)
         else:
-            return self.manual_allocation(available_ram_mb, available_cpus, available_disk_gb)
- 
-    def validate_resource_allocation(self, allocated_ram: int, allocated_cpus: int, allocated_disk: int) -> None:
-        """Validate the resource allocation."""
-        available_ram_mb, available_cpus, available_disk_gb = self.resource_assessment()
-        if allocated_ram > available_ram_mb or allocated_cpus > available_cpus or allocated_disk > available_disk_gb:
-            self.fail("Invalid resource allocation.")
+            allocated_ram, allocated_cpus, allocated_disk = self.manual_allocation(available_ram_mb, available_cpus, available_disk_gb, vm_count)
+
+        self.validate_allocation(allocated_ram * vm_count, allocated_cpus * vm_count, allocated_disk * vm_count,
+                                 available_ram_mb, available_cpus, available_disk_gb)
+        self.validate_cpu_count(allocated_cpus)
+        return allocated_ram, allocated_cpus, allocated_disk
  
     def create_vm(self, vm_name: str, iso_path: str) -> None:
         """Create a new VM with the specified configurations."""
-        self.log(logging.INFO, f"Attempting to create VM with name: {vm_name}, iso_path: {iso_path}")
- 
-        UEFI_PATH = self.get_uefi_path()
-        if not os.path.isfile(UEFI_PATH):
-            self.fail(f"UEFI firmware not found at specified path: {UEFI_PATH}")
- 
-        threads_per_core, sockets, numa_nodes = self.get_cpu_topology()
- 
-        available_ram_mb, available_cpus, available_disk_gb = self.resource_assessment()
-        auto_allocate = self.auto_or_manual_config()
- 
-        if auto_allocate.lower() == 'y':
-            allocated_ram, allocated_cpus, allocated_disk = self.auto_allocation(available_ram_mb, available_cpus, available_disk_gb)
-        else:
-            allocated_ram, allocated_cpus, allocated_disk = self.manual_allocation(available_ram_mb, available_cpus, available_disk_gb)
- 
-        self.validate_allocation(allocated_ram, allocated_cpus, allocated_disk, available_ram_mb, available_cpus, available_disk_gb)
- 
-        virt_install_cmd = [
-            "sudo", "virt-install",
-            "--name", vm_name,
-            "--ram", str(allocated_ram),
-            "--vcpus", str(allocated_cpus),
-            "--cpu", f"host,topology.sockets={sockets},topology.cores={allocated_cpus // threads_per_core // sockets},topology.threads={threads_per_core}",
-            "--os-type", "windows",
-            "--os-variant", "win10",
-            "--network", "network=default",
-            "--graphics", "spice",
-            "--cdrom", iso_path,
-            "--disk", f"path=/var/lib/libvirt/images/{vm_name}.img,size={allocated_disk},bus=scsi,format=qcow2,cache=writeback,discard=unmap",
-            "--controller", "type=scsi,model=virtio-scsi",
-            "--machine", "type=pc-q35-6.2", 
-            "--boot", f"uefi={UEFI_PATH},cdrom,hd",
-            "--memballoon", "model=virtio"
-        ]
- 
-        self.run_subprocess(virt_install_cmd, "Failed to create the VM.")
-        self.log(logging.INFO, f"Successfully created VM with name: {vm_name}")
- 
+        self.log(logging.INFO, "Attempting to create VM with name: %s, iso_path: %s", vm_name, iso_path)
+ 
+        self.validate_uefi_path()
+        self.validate_iso(iso_path)
+        allocated_ram, allocated_cpus, allocated_disk = self.allocate_resources()
+        self.install_vm(vm_name, iso_path, allocated_ram, allocated_cpus, allocated_disk)
+
+    def create_vms(self, specs: List[Tuple[str, str]], max_parallel: Optional[int] = None) -> None:
+        """Create several VMs from (vm_name, iso_path) specs with concurrent virt-install runs."""
+        self.log(logging.INFO, "Attempting to create %d VMs: %s", len(specs), ", ".join(name for name, _ in specs))
+
+        # Concurrent installs of one name would race on the same disk image and libvirt domain.
+        names = [name for name, _ in specs]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            self.fail(f"VM names must be unique. Duplicates: {', '.join(duplicates)}")
+        if max_parallel is not None and max_parallel < 1:
+            self.fail(f"max_parallel must be at least 1, got {max_parallel}.")
+
+        self.validate_uefi_path()
+        for _, iso_path in specs:
+            self.validate_iso(iso_path)
+        # Every VM gets the same allocation, so the whole batch must fit at once.
+        allocated_ram, allocated_cpus, allocated_disk = self.allocate_resources(len(specs))
+
+        with ThreadPoolExecutor(max_workers=max_parallel or os.cpu_count()) as executor:
+            futures = {
+                executor.submit(self.install_vm, vm_name, iso_path, allocated_ram, allocated_cpus, allocated_disk,
+                                ("--noautoconsole",)): vm_name
+                for vm_name, iso_path in specs
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    self.fail(f"Failed to create VM {futures[future]}. Error: {e}", e)
+
+    def validate_iso(self, iso_path: str) -> os.stat_result:
+        """Stat an installation ISO once per run and fail early if it is missing."""
+        iso_path = os.path.abspath(iso_path)
+        if iso_path not in self._iso_stats:
+            try:
+                iso_stat = os.stat(iso_path)
+            except OSError as e:
+                self.fail(f"Installation ISO {iso_path} is not accessible", e)
+            if not stat.S_ISREG(iso_stat.st_mode):
+                self.fail(f"Installation ISO {iso_path} is not a regular file.")
+            self._iso_stats[iso_path] = iso_stat
+        return self._iso_stats[iso_path]
+
+    def install_vm(self, vm_name: str, iso_path: str, allocated_ram: int, allocated_cpus: int, allocated_disk: int,
+                   extra_args: Tuple[str, ...] = ()) -> None:
+        """Prepare the VM's disk and run virt-install for it, removing the disk again if virt-install fails."""
+        virt_install_cmd = self.build_virt_install_cmd(vm_name, iso_path, allocated_ram, allocated_cpus)
+        # create_disk_image only returns once this call owns the image, so the cleanup below can't hit another VM's disk.
+        self.create_disk_image(vm_name, allocated_disk)
+        try:
+            self.run_subprocess(virt_install_cmd + list(extra_args), f"Failed to create the VM {vm_name}.")
+        except Exception:
+            self.remove_disk_image(vm_name)
+            raise
+        self.log(logging.INFO, "Successfully created VM with name: %s", vm_name)
+
+    def disk_path(self, vm_name: str) -> str:
+        """Path of the VM's system disk image."""
+        return f"{self.VM_IMAGES_DIR}/{vm_name}.img"
+
+    def create_disk_image(self, vm_name: str, allocated_disk: int) -> None:
+        """Create the VM's preallocated qcow2 disk, as a copy-on-write overlay when a base image is set."""
+        # qemu-img silently overwrites existing files, so first claim the path with an exclusive create
+        # (noclobber opens with O_EXCL). Of two concurrent callers only one can succeed, and an existing disk is never touched.
+        claim_cmd = ["sudo", "sh", "-c", 'set -C; : > "$1"', "sh", self.disk_path(vm_name)]
+        self.run_subprocess(claim_cmd, f"Disk image {self.disk_path(vm_name)} already exists or cannot be created. "
+                                       "Refusing to overwrite it.")
+        cmd = ["sudo", "qemu-img", "create", "-f", "qcow2"]
+        options = "preallocation=falloc,cluster_size=1M"
+        if self.base_image:
+            # qcow2 only allows preallocation together with a backing file when extended L2 entries are on.
+            cmd += ["-F", "qcow2", "-b", self.base_image]
+            options += ",extended_l2=on"
+        cmd += ["-o", options, self.disk_path(vm_name), f"{allocated_disk}G"]
+        try:
+            self.run_subprocess(cmd, f"Failed to create disk image for {vm_name}.")
+        except Exception:
+            self.remove_disk_image(vm_name)
+            raise
+        self.log(logging.INFO, "Created disk image for %s", vm_name)
+
+    def remove_disk_image(self, vm_name: str) -> None:
+        """Remove a disk image this run created for vm_name after a later step failed."""
+        self.log(logging.WARNING, "Removing disk image %s after a failed install.", self.disk_path(vm_name))
+        subprocess.run(["sudo", "rm", "-f", self.disk_path(vm_name)])
+
+    def validate_cpu_count(self, allocated_cpus: int) -> None:
+        """Fail unless allocated_cpus maps onto a whole number of cores per host socket."""
+        threads_per_core, sockets, _ = self.get_cpu_topology()
+        if allocated_cpus <= 0 or allocated_cpus % (threads_per_core * sockets) != 0:
+            self.fail(f"Cannot allocate {allocated_cpus} vCPUs: must be a positive multiple of "
+                      f"{threads_per_core * sockets} ({sockets} socket(s) x {threads_per_core} thread(s) per core).")
+
+    def cpu_topology_arg(self, allocated_cpus: int) -> str:
+        """Return the virt-install --cpu value for allocated_cpus, memoized per CPU count."""
+        if allocated_cpus not in self._cpu_topology_args:
+            self.validate_cpu_count(allocated_cpus)
+            threads_per_core, sockets, _ = self.get_cpu_topology()
+            cores = allocated_cpus // (threads_per_core * sockets)
+            self._cpu_topology_args[allocated_cpus] = (
+                f"host,topology.sockets={sockets},topology.cores={cores},topology.threads={threads_per_core}"
+            )
+        return self._cpu_topology_args[allocated_cpus]
+
+    def disk_spec(self, vm_name: str) -> str:
+        """Return the virt-install --disk value for the image made by create_disk_image."""
+        return f"path={self.disk_path(vm_name)},bus=scsi,format=qcow2,cache=none,io=native,discard=unmap,detect_zeroes=unmap"
+
+    def build_virt_install_cmd(self, vm_name: str, iso_path: str, allocated_ram: int, allocated_cpus: int) -> List[str]:
+        """Build the virt-install argv for a single VM."""
+        placement = self.numa_placement(allocated_ram, allocated_cpus)
+        fields = {
+            "vm_name": vm_name,
+            "ram": allocated_ram,
+            "vcpus": f"{allocated_cpus},cpuset={placement[1]}" if placement else allocated_cpus,
+            "cpu": self.cpu_topology_arg(allocated_cpus),
+            "iso_path": iso_path,
+            "disk": self.disk_spec(vm_name),
+            "boot": self.boot_spec(vm_name),
+        }
+        cmd = [arg.format_map(fields) for arg in self.VIRT_INSTALL_TEMPLATE]
+        if placement:
+            cmd += ["--numatune", f"{placement[0]},mode=preferred"]
+        if self.transient:
+            cmd.append("--transient")
+        return cmd
+
+    def numa_nodes_info(self) -> List[Tuple[int, str, int, int]]:
+        """Return (node id, cpulist, CPU count, free MB) for each NUMA node, read once from sysfs."""
+        if self._numa_nodes is None:
+            nodes = []
+            for node_dir in sorted(glob("/sys/devices/system/node/node[0-9]*")):
+                cpulist = Path(node_dir, "cpulist").read_text().strip()
+                free_kb = int(_NODE_MEMFREE_RE.search(Path(node_dir, "meminfo").read_bytes()).group(1))
+                nodes.append((int(Path(node_dir).name[4:]), cpulist, self.count_cpulist(cpulist), free_kb // 1024))
+            self._numa_nodes = nodes
+        return self._numa_nodes
+
+    def count_cpulist(self, cpulist: str) -> int:
+        """Count the CPUs in a kernel cpulist such as "0-3,8-11"."""
+        count = 0
+        for part in filter(None, cpulist.split(",")):
+            first, _, last = part.partition("-")
+            count += int(last or first) - int(first) + 1
+        return count
+
+    def numa_placement(self, allocated_ram: int, allocated_cpus: int) -> Optional[Tuple[int, str]]:
+        """Return (node id, cpulist) of the node with the most unclaimed free memory that fits the VM, or None."""
+        nodes = self.numa_nodes_info()
+        if len(nodes) < 2:
+            return None
+        # create_vms builds commands from several threads, so claims are made under a lock.
+        with self._numa_lock:
+            fitting = [
+                (free_mb - self._numa_claimed_mb.get(node_id, 0), node_id, cpulist)
+                for node_id, cpulist, cpu_count, free_mb in nodes
+                if cpu_count >= allocated_cpus and free_mb - self._numa_claimed_mb.get(node_id, 0) >= allocated_ram
+            ]
+            if not fitting:
+                return None
+            _, node_id, cpulist = max(fitting)
+            self._numa_claimed_mb[node_id] = self._numa_claimed_mb.get(node_id, 0) + allocated_ram
+        return node_id, cpulist
+
+    def boot_spec(self, vm_name: str) -> str:
+        """Return the virt-install --boot value; transient VMs keep their NVRAM in a per-run directory on tmpfs."""
+        uefi_path = self.UEFI_PATH
+        if not self.transient:
+            return f"uefi={uefi_path},cdrom,hd"
+        # The OVMF varstore template ships next to the code image (OVMF_CODE_4M.fd -> OVMF_VARS_4M.fd).
+        vars_template = uefi_path.replace("OVMF_CODE", "OVMF_VARS")
+        nvram_path = f"{self.transient_nvram_dir()}/{vm_name}_VARS.fd"
+        # libvirt reuses an existing varstore instead of copying the template, so a leftover file must never be picked up.
+        if os.path.lexists(nvram_path):
+            self.fail(f"NVRAM file {nvram_path} already exists. Refusing to reuse it.")
+        return f"uefi={uefi_path},nvram_template={vars_template},nvram={nvram_path},cdrom,hd"
+
+    def transient_nvram_dir(self) -> str:
+        """Create the root-owned tmpfs directory for this run's transient varstores once, and return its path."""
+        with self._nvram_lock:
+            if self._nvram_dir is None:
+                # mktemp makes a fresh, unguessable directory, so other local users can't plant varstores in it.
+                # 0711 lets the qemu user reach the files libvirt creates without being able to list or add any.
+                nvram_dir = self.run_subprocess(["sudo", "mktemp", "-d", "-p", "/dev/shm", "mxs-nvram.XXXXXXXX"],
+                                                "Failed to create the NVRAM directory.", capture=True).strip()
+                self.run_subprocess(["sudo", "chmod", "0711", nvram_dir], f"Failed to set permissions on {nvram_dir}.")
+                self._nvram_dir = nvram_dir
+            return self._nvram_dir
+
+def positive_int(value: str) -> int:
+    """argparse type for options that need an integer of at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Deploy a Windows 10 VM with VirtIO drivers.")
+    parser.add_argument("--vm-name", dest="vm_names", action="append", metavar="NAME",
+                        help="Name of a VM to create; repeat to create several VMs in parallel (default: MyVM).")
+    parser.add_argument("--max-parallel", type=positive_int, default=None, metavar="N",
+                        help="Maximum number of concurrent virt-install runs (default: CPU count).")
+    allocation = parser.add_mutually_exclusive_group()
+    allocation.add_argument("--auto-allocate", dest="auto_allocate", action="store_true", default=None,
+                            help="Allocate half of the available RAM, CPUs and disk without prompting.")
+    allocation.add_argument("--manual-allocate", dest="auto_allocate", action="store_false",
+                            help="Prompt for RAM, CPUs and disk instead of asking which mode to use.")
+    parser.add_argument("--transient", action="store_true",
+                        help="Create transient VMs that are not persisted by libvirt, with NVRAM kept on tmpfs.")
+    parser.add_argument("--base-image", metavar="PATH",
+                        help="qcow2 image to use as a copy-on-write backing file for each VM's disk.")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    stage1 = Stage1()
+    args = parse_args()
+    stage1 = Stage1(args.vm_names, args.max_parallel, args.base_image, args.auto_allocate, args.transient)
     stage1.main()